@@ -4,38 +4,106 @@ Anti-spoofing liveness detection module (V6 - with UI Feedback)
 
 import cv2
 import time
-import numpy as np
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import face_recognition
 
-SHOW_DEBUG_IMAGES = True
+SHOW_DEBUG_IMAGES = False
 LIVENESS_THRESHOLD_LOW = 1.5
 LIVENESS_THRESHOLD_HIGH = 25.0
+DETECTION_SCALE = 4  # Detect faces on a 1/4-size frame, then scale boxes back up
+
+# Single worker: only one liveness check runs at a time
+_executor = ThreadPoolExecutor(max_workers=1)
 
 def update_ui_feedback(label, message, color):
     """Helper function to update the UI label safely."""
+    if label.cget("text") == message and label.cget("fg") == color:
+        return # Nothing changed, skip the redraw
+    top = getattr(label, "_cached_top", None) or label.winfo_toplevel()
+    label._cached_top = top
     label.config(text=message, fg=color)
-    label.winfo_toplevel().update_idletasks() # Force immediate UI update
+    top.update_idletasks() # Force immediate UI update
+
+class LatestFrame:
+    """
+    Keeps grabbing from a cv2.VideoCapture on a daemon thread so the driver
+    buffer never fills with stale frames. Each frame is mirrored and
+    converted to RGB once, on that thread; read() returns the newest mirrored
+    BGR frame and read_rgb() the matching (BGR, RGB) pair.
+    Create one per camera, right after it is opened.
+    """
+
+    def __init__(self, cap):
+        self.cap = cap
+        self._frame = None
+        self._rgb = None
+        self._lock = threading.Lock()
+        self._running = True
+        self._thread = threading.Thread(target=self._reader, daemon=True)
+        self._thread.start()
+
+    def _reader(self):
+        while self._running:
+            if not self.cap.grab():
+                time.sleep(0.01)
+                continue
+            ok, frame = self.cap.retrieve()
+            if ok:
+                frame = cv2.flip(frame, 1)
+                rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                with self._lock:
+                    self._frame, self._rgb = frame, rgb
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def read(self):
+        """Same contract as VideoCapture.read(): (ret, frame), mirrored BGR."""
+        with self._lock:
+            frame = self._frame
+        return frame is not None, frame
+
+    def read_rgb(self):
+        """Returns (ret, frame, rgb): the newest mirrored BGR frame and its RGB copy."""
+        with self._lock:
+            frame, rgb = self._frame, self._rgb
+        return frame is not None, frame, rgb
+
+    def release(self):
+        self._running = False
+        self._thread.join(timeout=1)
+        self.cap.release()
 
 def get_live_frame(camera_object):
-    """Grabs multiple frames to clear the buffer and returns the latest one."""
-    for _ in range(5):
-        camera_object.grab()
+    """Returns the latest (already mirrored) frame from a LatestFrame reader."""
     ret, frame = camera_object.read()
     if not ret: return None
-    return cv2.flip(frame, 1)
+    return frame
+
+def detect_faces(frame):
+    """
+    Runs HOG face detection on a downscaled copy and returns full-size boxes.
+    Accepts a BGR or a grayscale frame (the HOG detector works on gray anyway).
+    """
+    scale = 1.0 / DETECTION_SCALE
+    small = cv2.resize(frame, (0, 0), fx=scale, fy=scale)
+    if small.ndim == 3:
+        small = cv2.cvtColor(small, cv2.COLOR_BGR2RGB)
+    locations = face_recognition.face_locations(small, model="hog")
+    return [tuple(coord * DETECTION_SCALE for coord in loc) for loc in locations]
 
-def test_from_frames(frame1, frame2, face_location):
-    """Compares the face region between two frames."""
+def test_from_frames(gray1, gray2, face_location):
+    """Compares the face region between two grayscale frames."""
     top, right, bottom, left = face_location
-    face1_roi = frame1[top:bottom, left:right]
-    face2_roi = frame2[top:bottom, left:right]
+    gray_face1 = gray1[top:bottom, left:right]
+    gray_face2 = gray2[top:bottom, left:right]
 
-    if face1_roi.size == 0 or face2_roi.size == 0:
+    if gray_face1.size == 0 or gray_face2.size == 0:
         return 0, "Error: Face crop failed"
 
-    gray_face1 = cv2.cvtColor(face1_roi, cv2.COLOR_BGR2GRAY)
-    gray_face2 = cv2.cvtColor(face2_roi, cv2.COLOR_BGR2GRAY)
-    mad = np.mean(np.abs(gray_face1.astype(np.float32) - gray_face2.astype(np.float32)))
+    mad = cv2.mean(cv2.absdiff(gray_face1, gray_face2))[0]
     
     if mad < LIVENESS_THRESHOLD_LOW:
         reason = "Too Still (Potential Photo)"
@@ -50,54 +118,105 @@ def test_from_frames(frame1, frame2, face_location):
     print(f"[Liveness INFO] Score (MAD) = {mad:.2f} | Result: {reason}")
     return (1 if success else 0), reason
 
-def test(camera_object, ui_feedback_label):
+def show_debug_window(ui_widget, title, image):
+    """Shows a debug image without blocking; the Tk loop closes it after 4s."""
+    cv2.imshow(title, image)
+    cv2.waitKey(1)
+
+    def close():
+        try: cv2.destroyWindow(title)
+        except: pass
+
+    ui_widget.after(4000, close)
+
+def _run_liveness(camera_object, notify, show_debug):
     """
-    Self-contained liveness procedure that provides real-time feedback to the UI.
+    The liveness procedure itself. All UI work goes through the two callbacks:
+    notify(message, color) and show_debug(title, image).
     """
     if not camera_object or not camera_object.isOpened():
-        update_ui_feedback(ui_feedback_label, "Camera Error!", "red")
+        notify("Camera Error!", "red")
         return 0, None
 
     # --- Step 1: Initial Capture ---
-    update_ui_feedback(ui_feedback_label, "Get Ready...\nHOLD STILL", "cyan")
+    notify("Get Ready...\nHOLD STILL", "cyan")
     time.sleep(1.5)
     f1 = get_live_frame(camera_object)
     if f1 is None:
-        update_ui_feedback(ui_feedback_label, "Frame 1 Capture Failed", "red")
+        notify("Frame 1 Capture Failed", "red")
         return 0, None
     
-    faces = face_recognition.face_locations(f1)
+    f1_gray = cv2.cvtColor(f1, cv2.COLOR_BGR2GRAY)
+
+    faces = detect_faces(f1_gray)
     if not faces:
-        update_ui_feedback(ui_feedback_label, "No face detected.\nPlease position your face in the center.", "red")
+        notify("No face detected.\nPlease position your face in the center.", "red")
         return 0, None
     face_location = faces[0]
 
     # --- Step 2: Movement Capture ---
-    update_ui_feedback(ui_feedback_label, ">>> NOW, MOVE YOUR\nHEAD SLOWLY <<<", "yellow")
+    notify(">>> NOW, MOVE YOUR\nHEAD SLOWLY <<<", "yellow")
     time.sleep(1.5)
     f2 = get_live_frame(camera_object)
     if f2 is None:
-        update_ui_feedback(ui_feedback_label, "Frame 2 Capture Failed", "red")
+        notify("Frame 2 Capture Failed", "red")
         return 0, None
 
     # --- Step 3: Analysis ---
-    update_ui_feedback(ui_feedback_label, "Analyzing...", "cyan")
+    notify("Analyzing...", "cyan")
     time.sleep(0.5)
-    result, reason = test_from_frames(f1, f2, face_location)
+    f2_gray = cv2.cvtColor(f2, cv2.COLOR_BGR2GRAY)
+    result, reason = test_from_frames(f1_gray, f2_gray, face_location)
 
     if result == 1:
-        update_ui_feedback(ui_feedback_label, "Liveness Check Passed!", "green")
+        notify("Liveness Check Passed!", "green")
         time.sleep(1)
     else:
-        update_ui_feedback(ui_feedback_label, f"Liveness Failed:\n{reason}", "red")
+        notify(f"Liveness Failed:\n{reason}", "red")
         if SHOW_DEBUG_IMAGES:
             top, right, bottom, left = face_location
+            # Draw on copies: the frames are shared with the camera feed
+            f1, f2 = f1.copy(), f2.copy()
             cv2.rectangle(f1, (left, top), (right, bottom), (0, 255, 0), 2)
             cv2.rectangle(f2, (left, top), (right, bottom), (0, 0, 255), 2)
-            debug_img = np.hstack((f1, f2))
-            cv2.imshow(f"Liveness Debug: {reason}", debug_img)
-            cv2.waitKey(4000)
-            try: cv2.destroyWindow(f"Liveness Debug: {reason}")
-            except: pass
+            show_debug(f"Liveness Debug: {reason}", cv2.hconcat([f1, f2]))
+
+    return result, f2
+
+def test(camera_object, ui_feedback_label):
+    """
+    Self-contained liveness procedure that provides real-time feedback to the UI.
+    Blocks the calling thread until the check is finished.
+    """
+    return _run_liveness(
+        camera_object,
+        lambda message, color: update_ui_feedback(ui_feedback_label, message, color),
+        lambda title, image: show_debug_window(ui_feedback_label, title, image)
+    )
+
+def test_async(camera_object):
+    """
+    Runs the liveness procedure on a worker thread so the Tk loop stays
+    responsive. The worker never touches Tk (not every Tcl build is
+    thread-safe): its UI updates go on a queue that the Tk thread applies
+    with pump_ui_events.
+    Returns (future, events); the Future resolves to (result, frame).
+    """
+    events = queue.Queue()
+
+    def notify(message, color):
+        events.put((update_ui_feedback, message, color))
+
+    def show_debug(title, image):
+        events.put((show_debug_window, title, image))
+
+    return _executor.submit(_run_liveness, camera_object, notify, show_debug), events
 
-    return result, f2
\ No newline at end of file
+def pump_ui_events(events, ui_feedback_label):
+    """Applies the UI updates queued by a test_async worker. Call from the Tk thread."""
+    while True:
+        try:
+            func, *args = events.get_nowait()
+        except queue.Empty:
+            return
+        func(ui_feedback_label, *args)
\ No newline at end of file
@@ -25,39 +25,14 @@ from datetime import date
 import db  # uses your existing db.py
 
 
-def cleanup_staff_open_sessions():
+def cleanup_open_sessions():
     """
+    Runs both cleanups on ONE connection, in ONE transaction:
+
     STAFF CLEANUP:
     For today's records in attendance_staff where time_out IS NULL,
     update status to 'Absent'.
-    """
-    conn = db.create_connection()
-    if not conn:
-        print("❌ Failed to connect to DB for staff cleanup.")
-        return
 
-    try:
-        today = date.today().strftime("%Y-%m-%d")
-        with conn.cursor() as cursor:
-            sql = """
-                UPDATE attendance_staff
-                SET status = 'Absent'
-                WHERE date = %s AND time_out IS NULL;
-            """
-            rows_affected = cursor.execute(sql, (today,))
-            conn.commit()
-            print(f"✅ Staff cleanup done. Rows updated: {rows_affected}")
-    except Exception as e:
-        print(f"❌ Error during staff cleanup: {e}")
-        if conn:
-            conn.rollback()
-    finally:
-        if conn:
-            conn.close()
-
-
-def cleanup_student_open_sessions():
-    """
     STUDENT CLEANUP:
     For today's records in attendance_students where time_out IS NULL,
     delete those rows.
@@ -71,24 +46,35 @@ def cleanup_student_open_sessions():
     NOTE: The MySQL trigger 'trg_attendance_students_after_delete' will
     automatically copy deleted rows into 'attendance_students_deleted'
     for history / audit.
+
+    Either both changes are committed or neither is.
     """
     conn = db.create_connection()
     if not conn:
-        print("❌ Failed to connect to DB for student cleanup.")
+        print("❌ Failed to connect to DB for daily cleanup.")
         return
 
     try:
-        today = date.today().strftime("%Y-%m-%d")
+        today = date.today()
         with conn.cursor() as cursor:
-            sql = """
+            cursor.execute("""
+                UPDATE attendance_staff
+                SET status = 'Absent'
+                WHERE date = %s AND time_out IS NULL;
+            """, (today,))
+            staff_rows = cursor.rowcount
+
+            cursor.execute("""
                 DELETE FROM attendance_students
                 WHERE date = %s AND time_out IS NULL;
-            """
-            rows_affected = cursor.execute(sql, (today,))
-            conn.commit()
-            print(f"✅ Student cleanup done. Rows deleted: {rows_affected}")
+            """, (today,))
+            student_rows = cursor.rowcount
+
+        conn.commit()
+        print(f"✅ Staff cleanup done. Rows updated: {staff_rows}")
+        print(f"✅ Student cleanup done. Rows deleted: {student_rows}")
     except Exception as e:
-        print(f"❌ Error during student cleanup: {e}")
+        print(f"❌ Error during daily cleanup: {e}")
         if conn:
             conn.rollback()
     finally:
@@ -98,8 +84,7 @@ def cleanup_student_open_sessions():
 
 def run_daily_cleanup():
     print("=== Running daily cleanup ===")
-    cleanup_staff_open_sessions()
-    cleanup_student_open_sessions()
+    cleanup_open_sessions()
     print("=== Cleanup finished ===")
 
 
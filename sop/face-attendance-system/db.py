@@ -1,6 +1,8 @@
 import pymysql
 from pymysql.cursors import DictCursor
 import os
+import queue
+import time
 
 # --- IMPORTANT ---
 # Make sure these credentials are correct for your MySQL setup.
@@ -8,21 +10,86 @@ DB_HOST = os.environ.get("DB_HOST", "localhost")
 DB_USER = os.environ.get("DB_USER", "root")
 DB_PASSWORD = os.environ.get("DB_PASSWORD", "Alexbenva@123")  # ← CHANGE if needed
 DB_NAME = os.environ.get("DB_NAME", "face_attendance")
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "4"))
+DB_POOL_PING_SECONDS = 5  # Pooled connections idle longer than this are pinged before reuse
+
+# Idle connections to DB_NAME as (conn, time returned), reused instead of
+# reconnecting on every call.
+_pool = queue.LifoQueue(maxsize=DB_POOL_SIZE)
+
+
+class PooledConnection:
+    """
+    Wraps a pymysql connection so that close() hands it back to the pool
+    instead of tearing down the socket. Everything else is delegated.
+    close() only rolls back when a cursor was opened since the last
+    commit() or rollback().
+    """
+
+    def __init__(self, conn):
+        self._conn = conn
+        self._dirty = False
+
+    @property
+    def open(self):
+        return self._conn is not None and self._conn.open
+
+    def cursor(self, *args, **kwargs):
+        self._dirty = True
+        return self._conn.cursor(*args, **kwargs)
+
+    def commit(self):
+        self._conn.commit()
+        self._dirty = False
+
+    def rollback(self):
+        self._conn.rollback()
+        self._dirty = False
+
+    def close(self):
+        conn, self._conn = self._conn, None
+        if conn is None:
+            return
+        try:
+            # End any open transaction so the next user starts clean
+            if self._dirty:
+                conn.rollback()
+            _pool.put_nowait((conn, time.monotonic()))
+        except (queue.Full, pymysql.err.Error):
+            try:
+                conn.close()
+            except pymysql.err.Error:
+                pass
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def _connect(db):
+    return pymysql.connect(
+        host=DB_HOST,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        database=db,
+        cursorclass=DictCursor,
+        autocommit=False
+    )
 
 
 def create_connection(db: str = None):
-    """Return a pymysql connection."""
+    """Return a pymysql connection (pooled when connecting to DB_NAME)."""
     try:
-        db_to_connect = db if db is not None else DB_NAME
-        conn = pymysql.connect(
-            host=DB_HOST,
-            user=DB_USER,
-            password=DB_PASSWORD,
-            database=db_to_connect,
-            cursorclass=DictCursor,
-            autocommit=False
-        )
-        return conn
+        if db is not None and db != DB_NAME:
+            return _connect(db)
+        try:
+            conn, returned_at = _pool.get_nowait()
+            # Recently used connections are assumed alive; only long-idle
+            # ones (possibly dropped by the server) cost a round trip
+            if time.monotonic() - returned_at > DB_POOL_PING_SECONDS:
+                conn.ping(reconnect=True)
+        except queue.Empty:
+            conn = _connect(DB_NAME)
+        return PooledConnection(conn)
     except pymysql.err.OperationalError as e:
         if "Unknown database" in str(e):
             return None
@@ -33,6 +100,191 @@ def create_connection(db: str = None):
         return None
 
 
+def _create_index(cur, name, table, columns):
+    """
+    Create an index, ignoring the error if it already exists.
+    Older MySQL doesn't support "IF NOT EXISTS" for indexes,
+    so just try to create it and ignore duplicate name errors.
+    """
+    try:
+        cur.execute(f"CREATE INDEX {name} ON {table} ({columns});")
+    except Exception as e:
+        print(f"(Info) Skipping index creation on {table}({columns}): {e}")
+
+
+def _drop_index(cur, name, table):
+    """Drop an index left over from an older schema, ignoring the error if it's not there."""
+    try:
+        cur.execute(f"DROP INDEX {name} ON {table};")
+    except Exception as e:
+        print(f"(Info) Skipping index drop {name} on {table}: {e}")
+
+
+def _add_column(cur, table, column, definition):
+    """Add a column to an existing table, ignoring the error if it already exists."""
+    try:
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition};")
+    except Exception as e:
+        print(f"(Info) Skipping column creation on {table}.{column}: {e}")
+
+
+def _migrate_to_blob(cur, table, column):
+    """
+    Convert a legacy LONGTEXT column (JSON face encodings) to LONGBLOB.
+    Existing JSON values are kept byte-for-byte; util decodes both formats.
+    """
+    cur.execute("""
+        SELECT DATA_TYPE AS data_type
+        FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s
+    """, (table, column))
+    row = cur.fetchone()
+    if row and row['data_type'].lower() == 'longtext':
+        print(f"Converting {table}.{column} to LONGBLOB...")
+        cur.execute(f"ALTER TABLE {table} MODIFY {column} LONGBLOB NOT NULL;")
+
+
+# Microsecond precision: the report cache compares a course's MAX(updated_at),
+# and two changes in the same second must still give different values
+_UPDATED_AT = "TIMESTAMP(6) DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6)"
+
+
+def _create_tables(conn):
+    """
+    DDL phase: create all tables and indexes.
+    MySQL implicitly commits after each DDL statement, so no transaction here.
+    """
+    with conn.cursor() as cur:
+        # --- students table ---
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS students (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                reg_no VARCHAR(50) UNIQUE NOT NULL,
+                name VARCHAR(200) NOT NULL,
+                department VARCHAR(100),
+                face_encoding LONGBLOB NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+
+        # --- staff table ---
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS staff (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                staff_id VARCHAR(50) UNIQUE NOT NULL,
+                name VARCHAR(200) NOT NULL,
+                course_id VARCHAR(100),
+                subject VARCHAR(100),
+                face_encoding LONGBLOB NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+
+        # Encodings are stored as raw float32 bytes; older tables used JSON text
+        _migrate_to_blob(cur, "students", "face_encoding")
+        _migrate_to_blob(cur, "staff", "face_encoding")
+
+        # --- class_schedule table ---
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS class_schedule (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                hour_name VARCHAR(50) UNIQUE NOT NULL,
+                start_time TIME NOT NULL,
+                end_time TIME NOT NULL,
+                entry_deadline TIME NOT NULL,
+                early_entry_minutes INT DEFAULT 15
+            );
+        """)
+
+        # --- attendance_students table (NO UNIQUE(reg_no, date)) ---
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS attendance_students (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                reg_no VARCHAR(50) NOT NULL,
+                date DATE NOT NULL,
+                time_in TIME NOT NULL,
+                time_out TIME,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP(6) DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6),
+                FOREIGN KEY (reg_no) REFERENCES students(reg_no) ON DELETE CASCADE
+            );
+        """)
+
+        # Daily cleanup / report lookups: WHERE date = ? AND time_out IS NULL
+        _create_index(cur, "idx_att_students_date_timeout", "attendance_students", "date, time_out")
+        # Report cache invalidation reads updated_at; older tables lack the column
+        _add_column(cur, "attendance_students", "updated_at",
+                    _UPDATED_AT)
+        # Per-student lookups: WHERE reg_no = ? AND date = ? AND time_out IS NULL,
+        # plus time_in for the attended-class join and updated_at for the report
+        # fingerprint, all answered from the index. The only UPDATE (exit marking)
+        # sets time_out, already an index column, so updated_at adds no index writes.
+        # It also serves the reg_no FK, so the older reg_no-only index is redundant
+        _create_index(cur, "idx_att_stud_reg_date", "attendance_students",
+                      "reg_no, date, time_out, time_in, updated_at")
+        _drop_index(cur, "idx_attendance_students_reg_no", "attendance_students")
+
+        # --- attendance_staff table ---
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS attendance_staff (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                staff_id VARCHAR(50) NOT NULL,
+                date DATE NOT NULL,
+                hour VARCHAR(20) NOT NULL,
+                time_in TIME NOT NULL,
+                time_out TIME,
+                status VARCHAR(10) DEFAULT 'Present',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP(6) DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6),
+                FOREIGN KEY (staff_id) REFERENCES staff(staff_id) ON DELETE CASCADE,
+                UNIQUE KEY unique_attendance_staff (staff_id, date, hour)
+            );
+        """)
+
+        _add_column(cur, "attendance_staff", "updated_at",
+                    _UPDATED_AT)
+        # Exit marking: WHERE staff_id = ? AND date = ? AND time_out IS NULL ORDER BY time_in DESC LIMIT 1,
+        # plus the report's staff_id/date lookups (hour comes from unique_attendance_staff)
+        # and updated_at for the report fingerprint. Exit marking already rewrites
+        # the entry for time_out; only the daily cleanup's status update is extra.
+        _create_index(cur, "idx_att_staff_open", "attendance_staff",
+                      "staff_id, date, time_out, time_in, updated_at")
+
+        # Course roster lookups: WHERE course_id = ? (reg_no for the joins).
+        # student_enrollment is managed outside this script, so this is
+        # skipped if the table doesn't exist yet.
+        _create_index(cur, "idx_enroll_course_reg", "student_enrollment", "course_id, reg_no")
+
+
+def _seed_schedule(conn):
+    """
+    DML phase: populate the schedule table if it's empty, in its own
+    transaction. INSERT IGNORE lets UNIQUE(hour_name) absorb a concurrent
+    seed instead of failing or duplicating rows.
+    """
+    conn.begin()
+    with conn.cursor() as cur:
+        cur.execute("SELECT COUNT(*) as count FROM class_schedule")
+        if cur.fetchone()['count'] == 0:
+            print("Populating class schedule with 8 hours for the first time...")
+            schedule_data = [
+                ('Hour 1', '08:30:00', '09:20:00', '09:15:00', 15),
+                ('Hour 2', '09:25:00', '10:15:00', '10:10:00', 15),
+                ('Hour 3', '10:20:00', '11:10:00', '11:05:00', 15),
+                ('Hour 4', '11:15:00', '12:05:00', '12:00:00', 15),
+                ('Hour 5', '13:00:00', '13:50:00', '13:45:00', 15),
+                ('Hour 6', '13:55:00', '14:45:00', '14:40:00', 15),
+                ('Hour 7', '14:50:00', '15:40:00', '15:35:00', 15),
+                ('Hour 8', '15:45:00', '16:35:00', '16:30:00', 15)
+            ]
+            cur.executemany("""
+                INSERT IGNORE INTO class_schedule
+                (hour_name, start_time, end_time, entry_deadline, early_entry_minutes)
+                VALUES (%s, %s, %s, %s, %s)
+            """, schedule_data)
+    conn.commit()
+
+
 def init_database():
     """Create the database and all required tables if they do not exist."""
     try:
@@ -58,105 +310,8 @@ def init_database():
             print("❌ Failed to connect to the database after ensuring its existence.")
             return False
 
-        with conn.cursor() as cur:
-            # --- students table ---
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS students (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    reg_no VARCHAR(50) UNIQUE NOT NULL,
-                    name VARCHAR(200) NOT NULL,
-                    department VARCHAR(100),
-                    face_encoding LONGTEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                );
-            """)
-
-            # --- staff table ---
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS staff (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    staff_id VARCHAR(50) UNIQUE NOT NULL,
-                    name VARCHAR(200) NOT NULL,
-                    course_id VARCHAR(100),
-                    subject VARCHAR(100),
-                    face_encoding LONGTEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                );
-            """)
-
-            # --- class_schedule table ---
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS class_schedule (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    hour_name VARCHAR(50) UNIQUE NOT NULL,
-                    start_time TIME NOT NULL,
-                    end_time TIME NOT NULL,
-                    entry_deadline TIME NOT NULL,
-                    early_entry_minutes INT DEFAULT 15
-                );
-            """)
-
-            # --- attendance_students table (NO UNIQUE(reg_no, date)) ---
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS attendance_students (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    reg_no VARCHAR(50) NOT NULL,
-                    date DATE NOT NULL,
-                    time_in TIME NOT NULL,
-                    time_out TIME,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (reg_no) REFERENCES students(reg_no) ON DELETE CASCADE
-                );
-            """)
-
-            # Ensure index on reg_no for FK & speed
-            # Older MySQL doesn't support "IF NOT EXISTS" for indexes,
-            # so just try to create it and ignore duplicate name errors.
-            try:
-                cur.execute("""
-                    CREATE INDEX idx_attendance_students_reg_no
-                    ON attendance_students (reg_no);
-                """)
-            except Exception as e:
-                print(f"(Info) Skipping index creation on attendance_students.reg_no: {e}")
-
-            # --- attendance_staff table ---
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS attendance_staff (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    staff_id VARCHAR(50) NOT NULL,
-                    date DATE NOT NULL,
-                    hour VARCHAR(20) NOT NULL,
-                    time_in TIME NOT NULL,
-                    time_out TIME,
-                    status VARCHAR(10) DEFAULT 'Present',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (staff_id) REFERENCES staff(staff_id) ON DELETE CASCADE,
-                    UNIQUE KEY unique_attendance_staff (staff_id, date, hour)
-                );
-            """)
-
-            # Populate the schedule table if it's empty
-            cur.execute("SELECT COUNT(*) as count FROM class_schedule")
-            if cur.fetchone()['count'] == 0:
-                print("Populating class schedule with 8 hours for the first time...")
-                schedule_data = [
-                    ('Hour 1', '08:30:00', '09:20:00', '09:15:00', 15),
-                    ('Hour 2', '09:25:00', '10:15:00', '10:10:00', 15),
-                    ('Hour 3', '10:20:00', '11:10:00', '11:05:00', 15),
-                    ('Hour 4', '11:15:00', '12:05:00', '12:00:00', 15),
-                    ('Hour 5', '13:00:00', '13:50:00', '13:45:00', 15),
-                    ('Hour 6', '13:55:00', '14:45:00', '14:40:00', 15),
-                    ('Hour 7', '14:50:00', '15:40:00', '15:35:00', 15),
-                    ('Hour 8', '15:45:00', '16:35:00', '16:30:00', 15)
-                ]
-                cur.executemany("""
-                    INSERT INTO class_schedule
-                    (hour_name, start_time, end_time, entry_deadline, early_entry_minutes)
-                    VALUES (%s, %s, %s, %s, %s)
-                """, schedule_data)
-
-        conn.commit()
+        _create_tables(conn)
+        _seed_schedule(conn)
         print("✅ All tables initialized successfully!")
         return True
 
@@ -1,11 +1,230 @@
 # generate_report.py
 
 import db
+import io
+import queue
+import threading
 from datetime import date
-import tkinter as tk
-from tkinter import scrolledtext
 
-def generate_course_report(course_id):
+# tkinter is imported inside ReportApp and the __main__ block only, so
+# callers that just want generate_course_report don't load Tcl/Tk.
+
+_EQ70 = "=" * 70
+_DASH70 = "-" * 70
+_DASH25 = "-" * 25
+
+# ReportApp inserts at most this many chunks (lines or student blocks) per
+# Tk callback, so the widget repaints between batches even on a fast DB
+_CHUNKS_PER_TICK = 8
+
+# Rendered reports keyed by (course_id, date, fingerprint). The fingerprint
+# only covers rows this course's report reads, so marks in other courses
+# don't invalidate it: the assigned staff member itself (id and name), that
+# member's attendance rows, and the enrolled students' attendance rows and
+# roster. updated_at has microsecond precision and the row counts catch
+# deletes; the CRC catches enrollment swaps and student name edits. No row
+# comes back while the course has no staff, which is also a valid key.
+# The attendance parts are read from idx_att_stud_reg_date and
+# idx_att_staff_open, which carry updated_at, so no table rows are touched.
+_REPORT_CACHE_SIZE = 32
+_report_cache = {}
+
+_REPORT_FINGERPRINT_SQL = """
+    SELECT st.staff_id, st.name,
+           (SELECT MAX(a.updated_at) FROM attendance_staff a
+            WHERE a.staff_id = st.staff_id) AS staff_changed,
+           (SELECT COUNT(*) FROM attendance_staff a
+            WHERE a.staff_id = st.staff_id) AS staff_rows,
+           att.changed AS students_changed, att.row_count AS student_rows,
+           roster.enrolled, roster.crc AS roster_crc
+    FROM (SELECT staff_id, name FROM staff WHERE course_id = %s LIMIT 1) st
+    CROSS JOIN (
+        SELECT MAX(a.updated_at) AS changed, COUNT(*) AS row_count
+        FROM student_enrollment se
+        JOIN attendance_students a ON a.reg_no = se.reg_no
+        WHERE se.course_id = %s
+    ) att
+    CROSS JOIN (
+        SELECT COUNT(*) AS enrolled,
+               BIT_XOR(CRC32(CONCAT_WS(CHAR(0), s.reg_no, s.name))) AS crc
+        FROM student_enrollment se
+        JOIN students s ON s.reg_no = se.reg_no
+        WHERE se.course_id = %s
+    ) roster
+"""
+
+# Report queries, defined once at import. PyMySQL interpolates parameters
+# client-side and has no server-side prepared statements, so these are
+# plain strings reused on every call.
+_Q_STAFF = """
+    SELECT s.name, s.staff_id, a.hour, a.status,
+           (SELECT COUNT(DISTINCT c.date)
+            FROM attendance_staff c
+            WHERE c.staff_id = s.staff_id) AS total_classes,
+           r.total_enrolled, r.present_today
+    FROM (SELECT name, staff_id FROM staff WHERE course_id = %s LIMIT 1) s
+    CROSS JOIN (
+        SELECT COUNT(*) AS total_enrolled,
+               COALESCE(SUM(EXISTS (SELECT 1
+                                    FROM attendance_students o
+                                    WHERE o.reg_no = e.reg_no
+                                      AND o.date = %s
+                                      AND o.time_out IS NULL)), 0) AS present_today
+        FROM student_enrollment e
+        JOIN students st ON st.reg_no = e.reg_no
+        WHERE e.course_id = %s
+    ) r
+    LEFT JOIN attendance_staff a
+      ON a.staff_id = s.staff_id
+     AND a.date = %s
+    ORDER BY a.hour
+"""
+
+# One row per enrolled student, ordered by name: whether they have an open
+# session today, and how many class days they attended. A date counts only if:
+#  - staff had class (attendance_staff row for that date & staff_id)
+#  - AND student's time_in was <= staff's time_out (i.e., during class)
+# COUNT(DISTINCT s.date) is required: attendance_students has no
+# UNIQUE(reg_no, date) (a student can exit and re-enter), and the join
+# yields one row per staff hour on that date.
+_Q_ENROLLED = """
+    SELECT st.reg_no, st.name,
+           EXISTS (SELECT 1
+                   FROM attendance_students a
+                   WHERE a.reg_no = st.reg_no
+                     AND a.date = %s
+                     AND a.time_out IS NULL) AS present_today,
+           COALESCE(att.attended_count, 0) AS attended_count
+    FROM students st
+    JOIN student_enrollment se ON st.reg_no = se.reg_no
+    LEFT JOIN (
+        SELECT s.reg_no, COUNT(DISTINCT s.date) AS attended_count
+        FROM attendance_students s
+        JOIN student_enrollment e
+          ON e.reg_no = s.reg_no
+         AND e.course_id = %s
+        JOIN attendance_staff t
+          ON t.date = s.date
+         AND t.staff_id = %s
+        WHERE t.time_out IS NULL OR s.time_in <= t.time_out
+        GROUP BY s.reg_no
+    ) att ON att.reg_no = st.reg_no
+    WHERE se.course_id = %s
+    ORDER BY st.name
+"""
+
+
+def _remember_report(cache_key, lines):
+    if len(_report_cache) >= _REPORT_CACHE_SIZE:
+        _report_cache.pop(next(iter(_report_cache)))
+    _report_cache[cache_key] = tuple(lines)
+
+
+def _enrolled_students(conn, course_id, staff_id, today):
+    """
+    Yields the students enrolled in a course, ordered by name, with today's
+    presence flag and attended count, streamed one row at a time
+    (server-side cursor). Not cached on its own: repeat requests are served
+    whole from _report_cache.
+    """
+    with conn.cursor(db.pymysql.cursors.SSDictCursor) as stream:
+        stream.execute(_Q_ENROLLED, (today, course_id, staff_id, course_id))
+        yield from stream
+
+
+def _build_course_report(conn, course_id, today):
+    """Yields the report lines for iter_course_report; DB errors propagate."""
+    with conn.cursor() as cursor:
+        # 1-3. One round trip for the staff member assigned to this course,
+        # their attendance rows for today (LEFT JOIN, one row per hour), the
+        # overall class days held (distinct dates in attendance_staff) and
+        # today's enrolled/present counts for the summary
+        cursor.execute(_Q_STAFF, (course_id, today, course_id, today))
+        staff_rows = cursor.fetchall()
+        
+        if not staff_rows:
+            yield f"Report Error:\nNo staff member found for Course ID '{course_id}'."
+            return
+
+        yield _EQ70
+        yield f"ATTENDANCE REPORT FOR COURSE: {course_id.upper()}"
+        yield f"Date: {today}"
+        yield _EQ70
+
+        staff_name = staff_rows[0]['name']
+        staff_id = staff_rows[0]['staff_id']
+        total_classes_held = staff_rows[0]['total_classes']
+        total_students = staff_rows[0]['total_enrolled']
+        present_today_count = int(staff_rows[0]['present_today'])
+        yield f"Instructor: {staff_name} (ID: {staff_id})\n"
+
+        # Staff attendance for today
+        staff_attendance = [row for row in staff_rows if row['hour'] is not None]
+        
+        if staff_attendance:
+            yield "Instructor Attendance (Today):"
+            for record in staff_attendance:
+                yield f"  - {record['hour']}: {record['status']}"
+        else:
+            yield "Instructor Attendance: Not Marked Today"
+        
+        yield _DASH70
+
+        yield "Overall Class Summary (Till Today):"
+        if total_classes_held > 0:
+            yield f"  Total Classes Conducted: {total_classes_held}"
+        else:
+            yield "  No classes have been conducted yet."
+        yield _DASH70
+
+    if not total_students:
+        yield "No students are enrolled in this course."
+        yield _EQ70
+        return
+
+    yield "Student Attendance:"
+
+    # 4-6. Per-student: today's status + overall. Whether classes have been
+    # held is loop-invariant, so decide it (and the scale factor) once
+    has_classes = total_classes_held > 0
+    inv_total = 100.0 / total_classes_held if has_classes else 0.0
+    no_overall = "    Overall Attendance: N/A"
+
+    # Enrolled students are streamed from the server in one query with
+    # today's presence and overall attended dates (no per-student queries)
+    for student in _enrolled_students(conn, course_id, staff_id, today):
+        reg_no = student['reg_no']
+
+        # --- TODAY'S STATUS ---
+        daily_status = "Present" if student['present_today'] else "Absent / Exited"
+
+        # --- OVERALL ATTENDANCE (TOTAL CLASSES + TOTAL ATTENDED) ---
+        overall = no_overall
+        if has_classes:
+            classes_attended = student['attended_count']
+            percentage = classes_attended * inv_total
+
+            overall = (f"    Overall Attendance: {classes_attended} / {total_classes_held} classes\n"
+                       f"    Percentage: {percentage:.2f}%")
+
+        # One chunk per student
+        yield (f"  - {student['name']} ({reg_no}):\n"
+               f"    Today's Status: {daily_status}\n"
+               f"{overall}")
+
+    # 7. Summary for today. Both counts come from _Q_STAFF; the roster
+    # query runs in the same transaction, so under InnoDB's default
+    # REPEATABLE READ it sees the same snapshot
+    absent_today_count = total_students - present_today_count
+    yield "\n" + _DASH25
+    yield "Today's Summary:"
+    yield f"  Total Enrolled: {total_students}"
+    yield f"  Present (Currently): {present_today_count}"
+    yield f"  Absent / Exited:   {absent_today_count}"
+    yield _EQ70
+
+
+def iter_course_report(course_id):
     """
     Generates a detailed attendance report for a given course on the current day,
     AND shows overall attendance info:
@@ -13,150 +232,55 @@ def generate_course_report(course_id):
       - Each student's total attended classes and percentage.
     A date counts as ATTENDED for a student only if they marked entry
     while the staff was still in class (before staff's time_out).
+
+    Yields the report in chunks (a line, or one block per student) so a UI
+    can render it as it is built.
     """
     conn = db.create_connection()
     if not conn:
-        return "Database Connection Error:\nCould not connect to the database."
+        yield "Database Connection Error:\nCould not connect to the database."
+        return
 
     try:
+        today = date.today()
         with conn.cursor() as cursor:
-            today = date.today().strftime('%Y-%m-%d')
-            report_lines = []
-            
-            report_lines.append("=" * 70)
-            report_lines.append(f"ATTENDANCE REPORT FOR COURSE: {course_id.upper()}")
-            report_lines.append(f"Date: {today}")
-            report_lines.append("=" * 70)
-
-            # 1. Find the staff member assigned to this course
-            cursor.execute("SELECT name, staff_id FROM staff WHERE course_id = %s", (course_id,))
-            staff_info = cursor.fetchone()
-            
-            if not staff_info:
-                return f"Report Error:\nNo staff member found for Course ID '{course_id}'."
-
-            staff_name = staff_info['name']
-            staff_id = staff_info['staff_id']
-            report_lines.append(f"Instructor: {staff_name} (ID: {staff_id})\n")
-
-            # 2. Staff attendance for today
-            cursor.execute("""
-                SELECT hour, status 
-                FROM attendance_staff 
-                WHERE staff_id = %s AND date = %s 
-                ORDER BY hour
-            """, (staff_id, today))
-            staff_attendance = cursor.fetchall()
-            
-            if staff_attendance:
-                report_lines.append("Instructor Attendance (Today):")
-                for record in staff_attendance:
-                    report_lines.append(f"  - {record['hour']}: {record['status']}")
-            else:
-                report_lines.append("Instructor Attendance: Not Marked Today")
-            
-            report_lines.append("-" * 70)
-
-            # 3. Overall class days held (distinct dates in attendance_staff)
-            cursor.execute("SELECT DISTINCT date FROM attendance_staff WHERE staff_id = %s", (staff_id,))
-            class_dates_records = cursor.fetchall()
-            class_dates = [record['date'] for record in class_dates_records]
-            total_classes_held = len(class_dates)
-
-            report_lines.append("Overall Class Summary (Till Today):")
-            if total_classes_held > 0:
-                report_lines.append(f"  Total Classes Conducted: {total_classes_held}")
-            else:
-                report_lines.append("  No classes have been conducted yet.")
-            report_lines.append("-" * 70)
-
-            # 4. Enrolled students
-            cursor.execute("""
-                SELECT s.reg_no, s.name 
-                FROM students s
-                JOIN student_enrollment se ON s.reg_no = se.reg_no
-                WHERE se.course_id = %s 
-                ORDER BY s.name
-            """, (course_id,))
-            enrolled_students = cursor.fetchall()
-
-            if not enrolled_students:
-                report_lines.append("No students are enrolled in this course.")
-                report_lines.append("=" * 70)
-                return "\n".join(report_lines)
-                
-            report_lines.append("Student Attendance:")
-
-            # 5. Per-student: today's status + overall
-            present_today_count = 0
-            for student in enrolled_students:
-                reg_no = student['reg_no']
-
-                # --- TODAY'S STATUS ---
-                cursor.execute("""
-                    SELECT time_in 
-                    FROM attendance_students
-                    WHERE reg_no = %s AND date = %s AND time_out IS NULL 
-                """, (reg_no, today))
-                student_today_attendance = cursor.fetchone()
-                
-                if student_today_attendance:
-                    daily_status = "Present"
-                    present_today_count += 1
-                else:
-                    daily_status = "Absent / Exited"
-
-                # --- OVERALL ATTENDANCE (TOTAL CLASSES + TOTAL ATTENDED) ---
-                overall_line_1 = "    Overall Attendance: N/A"
-                overall_line_2 = ""
-                if total_classes_held > 0:
-                    # Count only those dates where:
-                    #  - staff had class (attendance_staff row for that date & staff_id)
-                    #  - AND student's time_in was <= staff's time_out (i.e., during class)
-                    cursor.execute("""
-                        SELECT COUNT(DISTINCT s.date) AS attended_count
-                        FROM attendance_students s
-                        JOIN attendance_staff t
-                          ON t.date = s.date
-                         AND t.staff_id = %s
-                        WHERE s.reg_no = %s
-                          AND (t.time_out IS NULL OR s.time_in <= t.time_out)
-                    """, (staff_id, reg_no))
-
-                    row = cursor.fetchone()
-                    classes_attended = row['attended_count'] if row and row['attended_count'] is not None else 0
-                    percentage = (classes_attended / total_classes_held) * 100 if total_classes_held > 0 else 0.0
-
-                    overall_line_1 = f"    Overall Attendance: {classes_attended} / {total_classes_held} classes"
-                    overall_line_2 = f"    Percentage: {percentage:.2f}%"
-
-                report_lines.append(f"  - {student['name']} ({reg_no}):")
-                report_lines.append(f"    Today's Status: {daily_status}")
-                report_lines.append(overall_line_1)
-                if overall_line_2:
-                    report_lines.append(overall_line_2)
-
-            # 6. Summary for today
-            total_students = len(enrolled_students)
-            absent_today_count = total_students - present_today_count
-            report_lines.append("\n" + "-" * 25)
-            report_lines.append("Today's Summary:")
-            report_lines.append(f"  Total Enrolled: {total_students}")
-            report_lines.append(f"  Present (Currently): {present_today_count}")
-            report_lines.append(f"  Absent / Exited:   {absent_today_count}")
-            report_lines.append("=" * 70)
-            
-            return "\n".join(report_lines)
+            cursor.execute(_REPORT_FINGERPRINT_SQL, (course_id, course_id, course_id))
+            fingerprint = cursor.fetchone()
+            cache_key = (course_id, today,
+                         tuple(fingerprint.values()) if fingerprint else None)
+
+        cached_lines = _report_cache.get(cache_key)
+        if cached_lines is not None:
+            yield from cached_lines
+            return
+
+        lines = []
+        for line in _build_course_report(conn, course_id, today):
+            lines.append(line)
+            yield line
+        _remember_report(cache_key, lines)
 
     except Exception as e:
-        return f"An unexpected error occurred while generating the report:\n\n{e}"
+        yield f"An unexpected error occurred while generating the report:\n\n{e}"
     finally:
         if conn:
             conn.close()
 
 
+def generate_course_report(course_id):
+    """Returns the full course report (see iter_course_report) as one string."""
+    buf = io.StringIO()
+    for chunk in iter_course_report(course_id):
+        buf.write(chunk)
+        buf.write("\n")
+    return buf.getvalue()
+
+
 class ReportApp:
     def __init__(self, root):
+        import tkinter as tk
+        from tkinter import scrolledtext
+
         self.root = root
         self.root.title("Attendance Report Generator")
         self.root.geometry("700x650+400+100")
@@ -190,19 +314,53 @@ class ReportApp:
         self.report_text.pack(fill='both', expand=True)
         
     def display_report(self):
+        import tkinter as tk
         course_id = self.course_id_entry.get().strip()
-        if not course_id:
-            report_content = "Please enter a Course ID to generate a report."
-        else:
-            report_content = generate_course_report(course_id)
         
         self.report_text.config(state='normal')
         self.report_text.delete('1.0', tk.END)
-        self.report_text.insert(tk.INSERT, report_content)
-        self.report_text.config(state='disabled')
+        if not course_id:
+            self.report_text.insert(tk.END, "Please enter a Course ID to generate a report.")
+            self.report_text.config(state='disabled')
+            return
+
+        # Build the report on a worker thread; the Tk loop drains its chunks
+        self.generate_btn.config(state='disabled')
+        chunks = queue.Queue()
+        threading.Thread(target=self._run, args=(course_id, chunks), daemon=True).start()
+        self.root.after(50, self._feed, chunks)
+
+    def _run(self, course_id, chunks):
+        """Worker thread: queues each report chunk, then None when finished."""
+        try:
+            for chunk in iter_course_report(course_id):
+                chunks.put(chunk)
+        finally:
+            chunks.put(None)
+
+    def _feed(self, chunks):
+        """
+        Inserts up to _CHUNKS_PER_TICK queued chunks and re-schedules itself
+        until done: right after the repaint if more may be waiting, otherwise
+        after a short poll.
+        """
+        import tkinter as tk
+        for _ in range(_CHUNKS_PER_TICK):
+            try:
+                chunk = chunks.get_nowait()
+            except queue.Empty:
+                self.root.after(50, self._feed, chunks)
+                return
+            if chunk is None:
+                self.report_text.config(state='disabled')
+                self.generate_btn.config(state='normal')
+                return
+            self.report_text.insert(tk.END, chunk + "\n")
+        self.root.after(1, self._feed, chunks)
 
 
 if __name__ == "__main__":
+    import tkinter as tk
     app_root = tk.Tk()
     app = ReportApp(app_root)
     app_root.mainloop()
@@ -13,17 +13,44 @@ warnings.filterwarnings('ignore', category=UserWarning)
 import tkinter as tk
 from tkinter import messagebox, simpledialog, scrolledtext
 from datetime import datetime, date
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
 import cv2
 from PIL import Image, ImageTk
 import face_recognition
 import util
-from anti_spoof_test import test as liveness_test
+from anti_spoof_test import test_async as liveness_test_async, pump_ui_events, LatestFrame
 from db import init_database
 import db  # for report function
 
 
 # --- Configuration ---
 ENABLE_LIVENESS_CHECK = True
+REGISTRATION_SCALE = 0.5  # Downscale factor for the registration photo before encoding
+LIVENESS_CACHE_SECONDS = 10  # A failed ID correction can be retried this long without a new check
+STUDENTS_CACHE_SECONDS = 60  # "View Students" reuses the last roster this long
+CAM_REFRESH_MS = 33  # ~30 FPS; the display doesn't repaint faster than this
+CAM_VIEW_SIZE = (700, 520)  # Main camera label (width, height)
+PREVIEW_SIZE = (300, 300)   # Registration preview label (width, height)
+
+# Course reports are built off the Tk thread, one at a time
+_report_executor = ThreadPoolExecutor(max_workers=1)
+# Face detection + encoding for an attendance click; dlib releases the GIL,
+# so the camera feed keeps redrawing while it runs
+_recognition_executor = ThreadPoolExecutor(max_workers=1)
+
+
+def fit_to_size(image, width, height):
+    """
+    Shrinks an image to fit within width x height, keeping its aspect ratio.
+    Images that already fit are returned unchanged (never upscaled).
+    """
+    h, w = image.shape[:2]
+    scale = min(width / w, height / h)
+    if scale >= 1:
+        return image
+    return cv2.resize(image, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
 
 
 def generate_course_report(course_id):
@@ -44,58 +71,55 @@ def generate_course_report(course_id):
 
     try:
         with conn.cursor() as cursor:
-            today = date.today().strftime('%Y-%m-%d')
-            report_lines = []
+            today = date.today()
+            buf = io.StringIO()
             
-            report_lines.append("=" * 70)
-            report_lines.append(f"ATTENDANCE REPORT FOR COURSE: {course_id.upper()}")
-            report_lines.append(f"Date: {today}")
-            report_lines.append("=" * 70)
-
-            # 1. Find the staff member assigned to this course
-            cursor.execute("SELECT name, staff_id FROM staff WHERE course_id = %s", (course_id,))
-            staff_info = cursor.fetchone()
+            buf.write("=" * 70 + "\n")
+            buf.write(f"ATTENDANCE REPORT FOR COURSE: {course_id.upper()}\n")
+            buf.write(f"Date: {today}\n")
+            buf.write("=" * 70 + "\n")
+
+            # 1-3. One round trip for the staff member assigned to this course,
+            # their attendance for TODAY (LEFT JOIN, one row per hour) and the
+            # overall class count (each staff hour = 1 class)
+            cursor.execute("""
+                SELECT s.name, s.staff_id, a.hour, a.status,
+                       (SELECT COUNT(*)
+                        FROM attendance_staff c
+                        WHERE c.staff_id = s.staff_id) AS total_classes
+                FROM (SELECT name, staff_id FROM staff WHERE course_id = %s LIMIT 1) s
+                LEFT JOIN attendance_staff a
+                  ON a.staff_id = s.staff_id
+                 AND a.date = %s
+                ORDER BY a.hour
+            """, (course_id, today))
+            staff_rows = cursor.fetchall()
             
-            if not staff_info:
+            if not staff_rows:
                 return f"Report Error:\nNo staff member found for Course ID '{course_id}'."
 
-            staff_name = staff_info['name']
-            staff_id = staff_info['staff_id']
-            report_lines.append(f"Instructor: {staff_name} (ID: {staff_id})\n")
+            staff_name = staff_rows[0]['name']
+            staff_id = staff_rows[0]['staff_id']
+            total_classes_held = staff_rows[0]['total_classes']
+            buf.write(f"Instructor: {staff_name} (ID: {staff_id})\n\n")
 
-            # 2. Staff attendance for TODAY (per hour)
-            cursor.execute("""
-                SELECT hour, status 
-                FROM attendance_staff 
-                WHERE staff_id = %s AND date = %s 
-                ORDER BY hour
-            """, (staff_id, today))
-            staff_attendance_today = cursor.fetchall()
+            staff_attendance_today = [row for row in staff_rows if row['hour'] is not None]
             
             if staff_attendance_today:
-                report_lines.append("Instructor Attendance (Today):")
+                buf.write("Instructor Attendance (Today):\n")
                 for record in staff_attendance_today:
-                    report_lines.append(f"  - {record['hour']}: {record['status']}")
+                    buf.write(f"  - {record['hour']}: {record['status']}\n")
             else:
-                report_lines.append("Instructor Attendance: Not Marked Today")
+                buf.write("Instructor Attendance: Not Marked Today\n")
             
-            report_lines.append("-" * 70)
+            buf.write("-" * 70 + "\n")
 
-            # 3. OVERALL CLASS COUNT (each hour = 1 class)
-            cursor.execute("""
-                SELECT COUNT(*) AS total_classes
-                FROM attendance_staff
-                WHERE staff_id = %s
-            """, (staff_id,))
-            total_classes_row = cursor.fetchone()
-            total_classes_held = total_classes_row['total_classes'] if total_classes_row else 0
-
-            report_lines.append("Overall Class Summary (Till Today):")
+            buf.write("Overall Class Summary (Till Today):\n")
             if total_classes_held > 0:
-                report_lines.append(f"  Total Classes Conducted: {total_classes_held}")
+                buf.write(f"  Total Classes Conducted: {total_classes_held}\n")
             else:
-                report_lines.append("  No classes have been conducted yet.")
-            report_lines.append("-" * 70)
+                buf.write("  No classes have been conducted yet.\n")
+            buf.write("-" * 70 + "\n")
 
             # 4. Enrolled students
             cursor.execute("""
@@ -108,72 +132,77 @@ def generate_course_report(course_id):
             enrolled_students = cursor.fetchall()
 
             if not enrolled_students:
-                report_lines.append("No students are enrolled in this course.")
-                report_lines.append("=" * 70)
-                return "\n".join(report_lines)
+                buf.write("No students are enrolled in this course.\n")
+                buf.write("=" * 70)  # Last line: no trailing newline
+                return buf.getvalue()
                 
-            report_lines.append("Student Attendance:")
+            buf.write("Student Attendance:\n")
 
-            # 5. Per-student: today's status + overall (per class hour)
-            present_today_count = 0
+            # 5. Batched lookups for the whole course (no per-student queries)
+            # Students currently present (any open session today)
+            cursor.execute("""
+                SELECT DISTINCT reg_no
+                FROM attendance_students
+                WHERE date = %s AND time_out IS NULL
+                  AND reg_no IN (SELECT reg_no FROM student_enrollment WHERE course_id = %s)
+            """, (today, course_id))
+            present_set = {row['reg_no'] for row in cursor.fetchall()}
+
+            # Staff class-hours attended per student: match on date and require
+            # that the student's time_in is <= staff's time_out for that hour.
+            attended_by_reg = {}
+            if total_classes_held > 0:
+                cursor.execute("""
+                    SELECT s.reg_no, COUNT(DISTINCT t.date, t.hour) AS attended
+                    FROM attendance_staff t
+                    JOIN attendance_students s
+                      ON s.date = t.date
+                     AND (t.time_out IS NULL OR s.time_in <= t.time_out)
+                    JOIN student_enrollment se
+                      ON se.reg_no = s.reg_no
+                     AND se.course_id = %s
+                    WHERE t.staff_id = %s
+                    GROUP BY s.reg_no
+                """, (course_id, staff_id))
+                attended_by_reg = {row['reg_no']: row['attended'] for row in cursor.fetchall()}
+
+            # 6. Per-student: today's status + overall (per class hour)
             for student in enrolled_students:
                 reg_no = student['reg_no']
 
                 # --- TODAY'S STATUS (present if any open session today) ---
-                cursor.execute("""
-                    SELECT time_in 
-                    FROM attendance_students
-                    WHERE reg_no = %s AND date = %s AND time_out IS NULL 
-                """, (reg_no, today))
-                student_today_attendance = cursor.fetchone()
-                
-                if student_today_attendance:
-                    daily_status = "Present"
-                    present_today_count += 1
-                else:
-                    daily_status = "Absent / Exited"
+                daily_status = "Present" if reg_no in present_set else "Absent / Exited"
 
                 # --- OVERALL ATTENDANCE (per class hour) ---
                 overall_line_1 = "    Overall Attendance: N/A"
                 overall_line_2 = ""
                 if total_classes_held > 0:
-                    # Count how many staff class-hours this student attended:
-                    # We join on date, match student reg_no, and require that the
-                    # student's time_in is <= staff's time_out for that hour.
-                    cursor.execute("""
-                        SELECT COUNT(DISTINCT t.date, t.hour) AS attended_count
-                        FROM attendance_staff t
-                        JOIN attendance_students s
-                          ON s.date = t.date
-                         AND s.reg_no = %s
-                         AND (t.time_out IS NULL OR s.time_in <= t.time_out)
-                        WHERE t.staff_id = %s
-                    """, (reg_no, staff_id))
-
-                    row = cursor.fetchone()
-                    classes_attended = row['attended_count'] if row and row['attended_count'] is not None else 0
+                    classes_attended = attended_by_reg.get(reg_no, 0)
                     percentage = (classes_attended / total_classes_held) * 100 if total_classes_held > 0 else 0.0
 
                     overall_line_1 = f"    Overall Attendance: {classes_attended} / {total_classes_held} classes"
                     overall_line_2 = f"    Percentage: {percentage:.2f}%"
 
-                report_lines.append(f"  - {student['name']} ({reg_no}):")
-                report_lines.append(f"    Today's Status: {daily_status}")
-                report_lines.append(overall_line_1)
+                buf.write(f"  - {student['name']} ({reg_no}):\n")
+                buf.write(f"    Today's Status: {daily_status}\n")
+                buf.write(overall_line_1 + "\n")
                 if overall_line_2:
-                    report_lines.append(overall_line_2)
+                    buf.write(overall_line_2 + "\n")
 
-            # 6. Summary for today (current presence)
+            # 7. Summary for today (current presence)
+            # present_set already holds the DISTINCT enrolled students with
+            # an open session, as filtered by SQL
             total_students = len(enrolled_students)
+            present_today_count = len(present_set)
             absent_today_count = total_students - present_today_count
-            report_lines.append("\n" + "-" * 25)
-            report_lines.append("Today's Summary:")
-            report_lines.append(f"  Total Enrolled: {total_students}")
-            report_lines.append(f"  Present (Currently): {present_today_count}")
-            report_lines.append(f"  Absent / Exited:   {absent_today_count}")
-            report_lines.append("=" * 70)
+            buf.write("\n" + "-" * 25 + "\n")
+            buf.write("Today's Summary:\n")
+            buf.write(f"  Total Enrolled: {total_students}\n")
+            buf.write(f"  Present (Currently): {present_today_count}\n")
+            buf.write(f"  Absent / Exited:   {absent_today_count}\n")
+            buf.write("=" * 70)  # Last line: no trailing newline
             
-            return "\n".join(report_lines)
+            return buf.getvalue()
 
     except Exception as e:
         return f"An unexpected error occurred while generating the report:\n\n{e}"
@@ -196,17 +225,29 @@ class App:
             util.msg_box("Camera Error", "Could not open webcam.")
             self.win.destroy()
             return
+        # Keep at most one frame queued in the driver so reads are never stale
+        # (ignored by backends that don't support it)
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        self.camera = LatestFrame(self.cap)
         self.frame = None
+        self.cam_imgtk = None
+        self.prev_imgtk = None
         self.current_user_type = None
         self.widgets = {}
         self.captured_image = None
+        self.liveness_running = False
+        self.recognizing = False
+        # (expiry, user_type, frame, encoding) after a failed ID correction; see handle_attendance
+        self._live_retry = None
+        self._students_cache = None
+        self._roster_text = None  # (students, formatted text) for show_all_students
         
         self.setup_ui()
         self.update_cam()
 
     def setup_ui(self):
         self.cam_label = util.get_img_label(self.win)
-        self.cam_label.place(x=10, y=10, width=700, height=520)
+        self.cam_label.place(x=10, y=10, width=CAM_VIEW_SIZE[0], height=CAM_VIEW_SIZE[1])
 
         self.feedback_label = tk.Label(
             self.win,
@@ -244,6 +285,7 @@ class App:
     def show_student_ui(self):
         self.clear_widgets()
         self.current_user_type = 'student'
+        util.set_active_user_type('student')
         self.feedback_label.config(text="Student Portal")
         self.widgets['mark_entry_btn'] = util.get_button(self.win, "Mark Entry", "green", lambda: self.handle_attendance('entry'))
         self.widgets['mark_entry_btn'].place(x=750, y=100)
@@ -257,6 +299,7 @@ class App:
     def show_staff_ui(self):
         self.clear_widgets()
         self.current_user_type = 'staff'
+        util.set_active_user_type('staff')
         self.feedback_label.config(text="Staff Portal")
         self.widgets['mark_entry_btn'] = util.get_button(self.win, "Mark Attendance", "green", lambda: self.handle_attendance('entry'))
         self.widgets['mark_entry_btn'].place(x=750, y=100)
@@ -271,16 +314,27 @@ class App:
         self.widgets['back_btn'] = util.get_button(self.win, "< Back to Main Menu", "blue", self.show_main_menu)
         self.widgets['back_btn'].place(x=860, y=380)
 
-    def show_all_students(self):
+    def get_students(self):
+        """Registered students, cached on the App for STUDENTS_CACHE_SECONDS."""
+        if self._students_cache is not None and time.monotonic() < self._students_cache[0]:
+            return self._students_cache[1]
         students = util.get_all_students()
+        if students:
+            self._students_cache = (time.monotonic() + STUDENTS_CACHE_SECONDS, students)
+        return students
+
+    def show_all_students(self):
+        students = self.get_students()
         if not students:
             util.msg_box("Student Roster", "No students have been registered yet.")
             return
-        header = f"{'Reg No':<15} | {'Name':<25} | {'Department'}\n"
-        separator = "-" * 65 + "\n"
-        student_rows = [f"{s['reg_no']:<15} | {s['name']:<25} | {s['department']}" for s in students]
-        display_string = header + separator + "\n".join(student_rows)
-        util.msg_box("Registered Students List", display_string)
+        # The formatted text is rebuilt only when get_students returns a new roster
+        if self._roster_text is None or self._roster_text[0] is not students:
+            header = f"{'Reg No':<15} | {'Name':<25} | {'Department'}\n"
+            separator = "-" * 65 + "\n"
+            student_rows = [f"{s['reg_no']:<15} | {s['name']:<25} | {s['department']}" for s in students]
+            self._roster_text = (students, header + separator + "\n".join(student_rows))
+        util.msg_box("Registered Students List", self._roster_text[1])
 
     def open_report_window(self):
         """Opens a window for staff to generate course-wise attendance report."""
@@ -307,18 +361,33 @@ class App:
         )
         report_text.pack(fill='both', expand=True)
 
-        def do_generate():
-            course_id = course_entry.get().strip()
-            if not course_id:
-                report_content = "Please enter a Course ID to generate a report."
-            else:
-                report_content = generate_course_report(course_id)
-
+        def show_report(report_content):
             report_text.config(state='normal')
             report_text.delete('1.0', tk.END)
             report_text.insert(tk.INSERT, report_content)
             report_text.config(state='disabled')
 
+        def on_report_done(future):
+            if not report_win.winfo_exists():
+                return  # Window closed while the report was running
+            generate_btn.config(state='normal')
+            try:
+                show_report(future.result())
+            except Exception as e:
+                show_report(f"An unexpected error occurred while generating the report:\n\n{e}")
+
+        def do_generate():
+            course_id = course_entry.get().strip()
+            if not course_id:
+                show_report("Please enter a Course ID to generate a report.")
+                return
+
+            # Build the report on a worker thread; the window stays responsive
+            show_report("Generating...")
+            generate_btn.config(state='disabled')
+            future = _report_executor.submit(generate_course_report, course_id)
+            self.wait_for(future, on_report_done)
+
         generate_btn = tk.Button(
             top_frame,
             text="Generate Report",
@@ -346,6 +415,7 @@ class App:
             return
         hours_to_display = [item['hour_name'] for item in schedule]
         hour_vars = {}
+        selected = set()  # Kept in sync by the checkbox callbacks, so no var.get() round trips
 
         main_frame = tk.Frame(dialog)
         main_frame.pack(fill=tk.BOTH, expand=1, pady=10)
@@ -362,29 +432,31 @@ class App:
         checkbox_frame = tk.Frame(my_canvas)
         my_canvas.create_window((0, 0), window=checkbox_frame, anchor="nw")
 
+        def toggle_hour(hour):
+            selected.symmetric_difference_update((hour,))
+            validate_selection()
+
         def validate_selection():
-            is_any_selected = any(var.get() for var in hour_vars.values())
+            is_any_selected = bool(selected)
             submit_btn.config(
                 state='normal' if is_any_selected else 'disabled',
                 bg='green' if is_any_selected else 'grey'
             )
 
         for hour in hours_to_display:
-            var = tk.StringVar(value="")
+            var = tk.BooleanVar(value=False)
             cb = tk.Checkbutton(
                 checkbox_frame,
                 text=hour,
                 variable=var,
-                onvalue=hour,
-                offvalue="",
                 font=("Arial", 12),
-                command=validate_selection
+                command=lambda h=hour: toggle_hour(h)
             )
             cb.pack(anchor='w', padx=120, pady=2)
             hour_vars[hour] = var
 
         def on_submit():
-            selected_hours = [var.get() for var in hour_vars.values() if var.get()]
+            selected_hours = [hour for hour in hours_to_display if hour in selected]
             dialog.destroy()
             success_msgs, fail_msgs = [], []
             for hour in selected_hours:
@@ -412,28 +484,93 @@ class App:
         submit_btn.pack(pady=20)
         self.win.wait_window(dialog)
 
+    def wait_for(self, future, callback, on_poll=None):
+        """
+        Polls a Future from the Tk loop and calls callback(future) once it is done.
+        on_poll, if given, runs on every poll (and once more before callback).
+        """
+        if on_poll:
+            on_poll()
+        if future.done():
+            callback(future)
+        else:
+            self.win.after(50, self.wait_for, future, callback, on_poll)
+
     def handle_attendance(self, attendance_type):
-        if ENABLE_LIVENESS_CHECK:
-            live, recognition_frame = liveness_test(camera_object=self.cap, ui_feedback_label=self.feedback_label)
-            if live != 1:
-                self.win.after(2000, self.clear_feedback)
-                return
+        if self.liveness_running or self.recognizing:
+            return
+        retry, self._live_retry = self._live_retry, None
+        if (ENABLE_LIVENESS_CHECK and retry and time.monotonic() < retry[0]
+                and retry[1] == self.current_user_type):
+            # One retry after a failed ID correction: straight back to the
+            # correction dialog with the frame that passed liveness (never a
+            # fresh, unchecked one) and its encoding. Re-recognizing that same
+            # frame would only return the same wrong ID.
+            _, user_type, frame, encoding = retry
+            self.feedback_label.config(text="Liveness recently verified.", fg="green")
+            self.win.update_idletasks()
+            if user_type == 'student':
+                self.handle_misidentification(frame, attendance_type, encoding, allow_retry=False)
+            else:
+                self.handle_staff_misidentification(frame, attendance_type, encoding, allow_retry=False)
+        elif ENABLE_LIVENESS_CHECK:
+            # Runs on a worker thread; the camera feed keeps updating meanwhile
+            # Its progress messages are queued and shown from here, on the Tk
+            # thread, as long as the user stays in this portal
+            self.liveness_running = True
+            user_type = self.current_user_type
+            future, events = liveness_test_async(camera_object=self.camera)
+            self.wait_for(future, lambda f: self.on_liveness_done(f, attendance_type, user_type),
+                          lambda: user_type == self.current_user_type
+                          and pump_ui_events(events, self.feedback_label))
         else:
             self.feedback_label.config(text="Liveness check disabled.", fg="orange")
             self.win.update_idletasks()
-            recognition_frame = self.frame.copy()
+            self.recognize_and_mark(self.frame.copy(), attendance_type)
+
+    def on_liveness_done(self, future, attendance_type, user_type):
+        self.liveness_running = False
+        if user_type != self.current_user_type:
+            return  # The user left the portal while the check ran
+        try:
+            live, recognition_frame = future.result()
+        except Exception as e:
+            self.feedback_label.config(text=f"Liveness Error: {e}", fg="red")
+            self.win.after(3000, self.clear_feedback)
+            return
+        if live != 1:
+            self.win.after(2000, self.clear_feedback)
+            return
+        self.recognize_and_mark(recognition_frame, attendance_type)
 
+    def recognize_and_mark(self, recognition_frame, attendance_type):
         self.feedback_label.config(text="Recognizing face...", fg="cyan")
         self.win.update_idletasks()
-        user_id = util.recognize(recognition_frame, self.current_user_type)
+        self.recognizing = True
+        # recognize() matches against the current portal's faces; remember
+        # which one, in case the user navigates away before it finishes
+        user_type = self.current_user_type
+        future = _recognition_executor.submit(util.recognize, recognition_frame)
+        self.wait_for(future, lambda f: self.on_recognized(f, recognition_frame, attendance_type, user_type))
+
+    def on_recognized(self, future, recognition_frame, attendance_type, user_type):
+        self.recognizing = False
+        if user_type != self.current_user_type:
+            return  # The user left the portal while recognition ran
+        try:
+            user_id, encoding = future.result()
+        except Exception as e:
+            self.feedback_label.config(text=f"Recognition Error: {e}", fg="red")
+            self.win.after(3000, self.clear_feedback)
+            return
 
         if user_id in ['no_persons_found', 'unknown_person']:
-            result_text = "No face found." if user_id == 'no_persons_found' else f"Unknown {self.current_user_type}."
+            result_text = "No face found." if user_id == 'no_persons_found' else f"Unknown {user_type}."
             self.feedback_label.config(text=result_text, fg="red")
             self.win.after(3000, self.clear_feedback)
             return
 
-        if self.current_user_type == 'student':
+        if user_type == 'student':
             student = util.get_student_by_reg_no(user_id)
             if not student:
                 self.feedback_label.config(text=f"Error: Student data not found for {user_id}.", fg="red")
@@ -448,7 +585,7 @@ class App:
             if confirm:
                 self.mark_student_attendance(user_id, attendance_type, student['name'])
             else:
-                self.handle_misidentification(recognition_frame, attendance_type)
+                self.handle_misidentification(recognition_frame, attendance_type, encoding)
         
         else:  # staff
             user_data = util.get_staff_by_id(user_id)
@@ -465,7 +602,7 @@ class App:
             if confirm:
                 self.mark_staff_attendance(user_id, attendance_type, user_data['name'])
             else:
-                self.handle_staff_misidentification(recognition_frame, attendance_type)
+                self.handle_staff_misidentification(recognition_frame, attendance_type, encoding)
 
     def mark_student_attendance(self, reg_no, attendance_type, name):
         greeting = "Welcome" if attendance_type == 'entry' else "Goodbye"
@@ -490,68 +627,62 @@ class App:
             self.feedback_label.config(text=final_message, fg=color)
             self.win.after(3000, self.clear_feedback)
 
-    def handle_misidentification(self, frame, attendance_type):
+    def handle_misidentification(self, frame, attendance_type, encoding=None, allow_retry=True):
         """Handles the workflow when initial student face recognition is incorrect."""
-        manual_reg_no = simpledialog.askstring(
+        self._handle_misid(frame, attendance_type, encoding, util.verify_face, util.get_student_by_reg_no,
+                           self.mark_student_attendance, "Register Number", "Reg No", "Student", allow_retry)
+
+    def handle_staff_misidentification(self, frame, attendance_type, encoding=None, allow_retry=True):
+        self._handle_misid(frame, attendance_type, encoding, util.verify_staff_face, util.get_staff_by_id,
+                           self.mark_staff_attendance, "Staff ID", "Staff ID", "Staff", allow_retry)
+
+    def _handle_misid(self, frame, attendance_type, encoding, verify_fn, get_fn, mark_fn,
+                      id_label, short_label, kind, allow_retry):
+        """
+        Shared correction flow: ask for the correct ID, verify the face against
+        it, then mark attendance. The encoding from recognize() is handed to
+        verify_fn, which only encodes the frame itself when there is none.
+        If the correction fails and allow_retry is set, the next click may
+        retry it once without a new liveness check.
+        """
+        manual_id = simpledialog.askstring(
             "Incorrect Identification",
-            "Please enter your correct Register Number:",
+            f"Please enter your correct {id_label}:",
             parent=self.win
         )
-        if not manual_reg_no:
+        if not manual_id:
             self.feedback_label.config(text="Correction cancelled.", fg="orange")
             self.win.after(2000, self.clear_feedback)
+            if allow_retry:
+                self._allow_live_retry(frame, encoding)
             return
 
-        manual_reg_no = manual_reg_no.strip()
-        self.feedback_label.config(text=f"Verifying face for\n{manual_reg_no}...", fg="cyan")
+        manual_id = manual_id.strip()
+        self.feedback_label.config(text=f"Verifying face for\n{manual_id}...", fg="cyan")
         self.win.update_idletasks()
 
-        if util.verify_face(frame, manual_reg_no):
+        if verify_fn(frame, manual_id, precomputed_encoding=encoding):
             self.feedback_label.config(text="Verification Success!", fg="green")
             self.win.update_idletasks()
-            student = util.get_student_by_reg_no(manual_reg_no)
-            if student:
-                self.mark_student_attendance(manual_reg_no, attendance_type, student['name'])
+            user = get_fn(manual_id)
+            if user:
+                mark_fn(manual_id, attendance_type, user['name'])
             else:
-                self.feedback_label.config(text="Error: Student data not found.", fg="red")
+                self.feedback_label.config(text=f"Error: {kind} data not found.", fg="red")
                 self.win.after(3000, self.clear_feedback)
         else:
             self.feedback_label.config(
-                text="Verification FAILED.\nFace does not match Reg No.",
+                text=f"Verification FAILED.\nFace does not match {short_label}.",
                 fg="red"
             )
             self.win.after(3000, self.clear_feedback)
+            if allow_retry:
+                self._allow_live_retry(frame, encoding)
 
-    def handle_staff_misidentification(self, frame, attendance_type):
-        manual_staff_id = simpledialog.askstring(
-            "Incorrect Identification",
-            "Please enter your correct Staff ID:",
-            parent=self.win
-        )
-        if not manual_staff_id:
-            self.feedback_label.config(text="Correction cancelled.", fg="orange")
-            self.win.after(2000, self.clear_feedback)
-            return
-
-        manual_staff_id = manual_staff_id.strip()
-        self.feedback_label.config(text=f"Verifying face for\n{manual_staff_id}...", fg="cyan")
-        self.win.update_idletasks()
-
-        if util.verify_staff_face(frame, manual_staff_id):
-            self.feedback_label.config(text="Verification Success!", fg="green")
-            self.win.update_idletasks()
-            staff = util.get_staff_by_id(manual_staff_id)
-            if staff:
-                self.mark_staff_attendance(manual_staff_id, attendance_type, staff['name'])
-            else:
-                self.feedback_label.config(text="Error: Staff data not found.", fg="red")
-                self.win.after(3000, self.clear_feedback)
-        else:
-            self.feedback_label.config(
-                text="Verification FAILED.\nFace does not match Staff ID.",
-                fg="red"
-            )
-            self.win.after(3000, self.clear_feedback)
+    def _allow_live_retry(self, frame, encoding):
+        """Lets the next attendance click retry the correction for this liveness-checked frame once."""
+        self._live_retry = (time.monotonic() + LIVENESS_CACHE_SECONDS, self.current_user_type,
+                            frame, encoding)
 
     def register_student(self):
         self.reg_win = tk.Toplevel(self.win)
@@ -571,10 +702,10 @@ class App:
         self.dept_e.place(x=330, y=220, width=220)
 
         self.prev_lbl = util.get_img_label(self.reg_win)
-        self.prev_lbl.place(x=10, y=10, width=300, height=300)
+        self.prev_lbl.place(x=10, y=10, width=PREVIEW_SIZE[0], height=PREVIEW_SIZE[1])
+        self.prev_imgtk = None
 
         util.get_button(self.reg_win, "Capture & Save", "green", self.save_student).place(x=350, y=300)
-        self.update_preview()
 
     def register_staff(self):
         self.reg_win = tk.Toplevel(self.win)
@@ -598,11 +729,30 @@ class App:
         self.subject_e.place(x=330, y=300, width=220)
 
         self.prev_lbl = util.get_img_label(self.reg_win)
-        self.prev_lbl.place(x=10, y=10, width=300, height=300)
+        self.prev_lbl.place(x=10, y=10, width=PREVIEW_SIZE[0], height=PREVIEW_SIZE[1])
+        self.prev_imgtk = None
 
         util.get_button(self.reg_win, "Capture & Save", "green", self.save_staff).place(x=350, y=350)
-        self.update_preview()
         
+    def _encode_registration(self, image):
+        """
+        Returns the face encoding of a registration photo (BGR), or None if no
+        face is found. One close-up face: encode at REGISTRATION_SCALE, in the
+        RGB order face_recognition expects (as util.encode_face does for probes).
+        """
+        small = cv2.resize(image, (0, 0), fx=REGISTRATION_SCALE, fy=REGISTRATION_SCALE,
+                           interpolation=cv2.INTER_AREA)
+        encodings = face_recognition.face_encodings(cv2.cvtColor(small, cv2.COLOR_BGR2RGB))
+        return encodings[0] if encodings else None
+
+    def _confirm_reenroll(self, kind, user):
+        """Asks whether to replace an already registered person's face with the new photo."""
+        return messagebox.askyesno(
+            "Already Registered",
+            f"{kind} {user['name']} is already registered.\n\nReplace their face with this photo?",
+            parent=self.reg_win
+        )
+
     def save_student(self):
         name = self.name_e.get().strip()
         reg = self.regno_e.get().strip()
@@ -613,14 +763,25 @@ class App:
         if self.captured_image is None:
             util.msg_box("Error", "Could not capture an image.")
             return
-        encodings = face_recognition.face_encodings(self.captured_image)
-        if not encodings:
+        encoding = self._encode_registration(self.captured_image)
+        if encoding is None:
             util.msg_box("Face Detection Failed", "Could not detect a face in the image. Please try again.")
             return
-        if util.add_student(name, reg, dept, encodings[0]):
+        if util.add_student(name, reg, dept, encoding):
+            self._students_cache = None
+            self._roster_text = None
             util.msg_box("Success", f"✓ {name} ({reg}) registered successfully!")
             self.reg_win.destroy()
-        else:
+            return
+        # An existing reg no can be re-enrolled with the new photo
+        student = util.get_student_by_reg_no(reg)
+        if student and self._confirm_reenroll("Student", student):
+            if util.update_student_face(reg, encoding):
+                util.msg_box("Success", f"✓ Face updated for {student['name']} ({reg}).")
+                self.reg_win.destroy()
+            else:
+                util.msg_box("Error", "Could not update the face. Please try again.")
+        elif not student:
             util.msg_box("Error", "Registration number may already exist.")
         
     def save_staff(self):
@@ -634,39 +795,62 @@ class App:
         if self.captured_image is None:
             util.msg_box("Error", "Could not capture an image from the camera.")
             return
-        encodings = face_recognition.face_encodings(self.captured_image)
-        if not encodings:
+        encoding = self._encode_registration(self.captured_image)
+        if encoding is None:
             util.msg_box(
                 "Face Detection Failed",
                 "Could not detect a face in the image.\n\nPlease ensure your face is centered and well-lit."
             )
             return
-        if util.add_staff(name, staff_id, course, subject, encodings[0]):
+        if util.add_staff(name, staff_id, course, subject, encoding):
             util.msg_box("Success", f"✓ {name} ({staff_id}) registered successfully!")
             self.reg_win.destroy()
-        else:
+            return
+        # An existing staff ID can be re-enrolled with the new photo
+        staff = util.get_staff_by_id(staff_id)
+        if staff and self._confirm_reenroll("Staff member", staff):
+            if util.update_staff_face(staff_id, encoding):
+                util.msg_box("Success", f"✓ Face updated for {staff['name']} ({staff_id}).")
+                self.reg_win.destroy()
+            else:
+                util.msg_box("Error", "Could not update the face. Please try again.")
+        elif not staff:
             util.msg_box("Error", "Failed to register.\nStaff ID may already exist.")
 
-    def update_preview(self):
+    def show_frame(self, label, rgb, photo):
+        """
+        Shows an RGB frame on a label. The existing PhotoImage (or None) is
+        reused via paste() when the size matches, otherwise a new one is made.
+        Returns the PhotoImage now on the label.
+        """
+        h, w = rgb.shape[:2]
+        image = Image.frombuffer('RGB', (w, h), rgb, 'raw', 'RGB', 0, 1)
+        if photo is None or (photo.width(), photo.height()) != (w, h):
+            photo = ImageTk.PhotoImage(image)
+            label.configure(image=photo)
+        else:
+            photo.paste(image)
+        return photo
+
+    def update_preview(self, rgb):
+        """
+        Shows the camera feed in the registration preview. Called from
+        update_cam with the frame it already converted to RGB.
+        """
         if not hasattr(self, 'reg_win') or not self.reg_win.winfo_exists():
             return
-        if self.frame is not None:
-            self.captured_image = self.frame.copy()
-            rgb = cv2.cvtColor(self.captured_image, cv2.COLOR_BGR2RGB)
-            imgtk = ImageTk.PhotoImage(Image.fromarray(rgb))
-            self.prev_lbl.imgtk = imgtk
-            self.prev_lbl.configure(image=imgtk)
-        self.prev_lbl.after(20, self.update_preview)
+        # Each new frame is a fresh array from the grabber thread, so no copy
+        self.captured_image = self.frame
+        self.prev_imgtk = self.show_frame(self.prev_lbl, fit_to_size(rgb, *PREVIEW_SIZE), self.prev_imgtk)
 
     def update_cam(self):
-        ret, frame = self.cap.read()
-        if ret:
-            self.frame = cv2.flip(frame, 1)
-            rgb = cv2.cvtColor(self.frame, cv2.COLOR_BGR2RGB)
-            imgtk = ImageTk.PhotoImage(Image.fromarray(rgb))
-            self.cam_label.imgtk = imgtk
-            self.cam_label.configure(image=imgtk)
-        self.update_cam_job = self.cam_label.after(10, self.update_cam)
+        # Mirroring and BGR->RGB already happened once on the grabber thread
+        ret, frame, rgb = self.camera.read_rgb()
+        if ret and frame is not self.frame:  # Skip ticks with no new frame
+            self.frame = frame
+            self.cam_imgtk = self.show_frame(self.cam_label, fit_to_size(rgb, *CAM_VIEW_SIZE), self.cam_imgtk)
+            self.update_preview(rgb)
+        self.update_cam_job = self.cam_label.after(CAM_REFRESH_MS, self.update_cam)
 
     def clear_feedback(self):
         default_text = "Welcome! Please select a portal."
@@ -679,7 +863,7 @@ class App:
     def logout(self):
         if hasattr(self, 'update_cam_job') and self.update_cam_job:
             self.cam_label.after_cancel(self.update_cam_job)
-        self.cap.release()
+        self.camera.release()
         self.win.destroy()
 
     def start(self):
@@ -1,16 +1,38 @@
 import tkinter as tk
 from tkinter import messagebox
 import db
+import cv2
 import face_recognition
 import numpy as np
+from anti_spoof_test import detect_faces
 import json
-from datetime import date, datetime, timedelta
+import time
+from datetime import datetime, timedelta, time as dt_time
 
 # --- Globals for caching face data ---
-known_face_encodings_students = []
+# Encodings are (M, 128) float32 matrices, one row per id in the matching list,
+# with each row's squared norm cached alongside for recognize()
+ENCODING_SIZE = 128
+ENCODING_DTYPE = '<f4'  # On-disk format: little-endian float32, 512 bytes per face
+ENCODING_BYTES = ENCODING_SIZE * 4
+MATCH_TOLERANCE = 0.6  # face_recognition's default compare_faces tolerance
+VERIFY_TOLERANCE = 0.5  # Stricter, for confirming a manually entered ID
+known_face_encodings_students = np.empty((0, ENCODING_SIZE), dtype=np.float32)
+known_face_sq_students = np.empty(0, dtype=np.float32)
 known_face_ids_students = []
-known_face_encodings_staff = []
+known_face_encodings_staff = np.empty((0, ENCODING_SIZE), dtype=np.float32)
+known_face_sq_staff = np.empty(0, dtype=np.float32)
 known_face_ids_staff = []
+# The (encodings, squared norms, ids) recognize() matches against, swapped as
+# one tuple so a recognition on the worker thread never sees a mixed set;
+# see set_active_user_type
+_active_user_type = None
+_active_faces = (known_face_encodings_staff, known_face_sq_staff, known_face_ids_staff)
+
+# --- Class schedule cache: (expiry, rows). The schedule is seeded once and
+# rarely edited, so re-read it only every few minutes ---
+SCHEDULE_CACHE_SECONDS = 300
+_schedule_cache = None
 
 #region UI Helpers
 def get_button(window, text, color, command, fg='white'):
@@ -25,89 +47,180 @@ def msg_box(title, description):
 #endregion
 
 #region Face Data Loading and Recognition
+def _encoding_to_db(encoding):
+    """Serializes a face encoding for the face_encoding column (128 little-endian float32)."""
+    return encoding.astype(ENCODING_DTYPE, copy=False).tobytes()
+
+def _encoding_matrix(blobs):
+    """Packs stored face_encoding values into one (M, 128) float32 matrix."""
+    if all(len(blob) == ENCODING_BYTES for blob in blobs):
+        # Binary format: one join, then a zero-copy (read-only) view on little-endian hosts
+        return np.frombuffer(b''.join(blobs), dtype=ENCODING_DTYPE).reshape(-1, ENCODING_SIZE).astype(np.float32, copy=False)
+
+    # Rows saved before the BLOB migration still hold JSON text
+    matrix = np.empty((len(blobs), ENCODING_SIZE), dtype=np.float32)
+    for i, blob in enumerate(blobs):
+        if len(blob) == ENCODING_BYTES:
+            matrix[i] = np.frombuffer(blob, dtype=ENCODING_DTYPE)
+        else:
+            matrix[i] = json.loads(blob)
+    return matrix
+
+def _squared_norms(matrix):
+    """Per-row squared L2 norms of an encoding matrix."""
+    return np.einsum('ij,ij->i', matrix, matrix)
+
+def _with_face(encodings, sq_norms, ids, user_id, row):
+    """
+    Returns new (encodings, squared norms, ids) with user_id's row replaced,
+    or appended if user_id is new. The inputs are left untouched.
+    """
+    sq = _squared_norms(row)
+    if user_id in ids:
+        i = ids.index(user_id)
+        encodings = encodings.copy()
+        sq_norms = sq_norms.copy()
+        encodings[i] = row[0]
+        sq_norms[i] = sq[0]
+        return encodings, sq_norms, ids
+    return np.vstack([encodings, row]), np.concatenate([sq_norms, sq]), ids + [user_id]
+
+def _remember_face(user_type, user_id, encoding):
+    """Adds or replaces a face in the in-memory matrix, instead of reloading all faces."""
+    global known_face_encodings_students, known_face_sq_students, known_face_ids_students
+    global known_face_encodings_staff, known_face_sq_staff, known_face_ids_staff
+    row = encoding.astype(np.float32).reshape(1, ENCODING_SIZE)
+    # Build new arrays rather than editing in place, so the active tuple stays consistent
+    if user_type == 'student':
+        known_face_encodings_students, known_face_sq_students, known_face_ids_students = _with_face(
+            known_face_encodings_students, known_face_sq_students, known_face_ids_students, user_id, row)
+    else:
+        known_face_encodings_staff, known_face_sq_staff, known_face_ids_staff = _with_face(
+            known_face_encodings_staff, known_face_sq_staff, known_face_ids_staff, user_id, row)
+    # recognize() may hold the old matrix
+    set_active_user_type(_active_user_type)
+
 def load_known_faces():
     """Loads all student and staff face encodings from the database into memory."""
-    global known_face_encodings_students, known_face_ids_students
-    global known_face_encodings_staff, known_face_ids_staff
+    global known_face_encodings_students, known_face_sq_students, known_face_ids_students
+    global known_face_encodings_staff, known_face_sq_staff, known_face_ids_staff
     
     conn = db.create_connection()
     if not conn:
         return
     try:
-        with conn.cursor() as cursor:
+        # Plain tuple rows: no per-row dict for the two columns read here
+        with conn.cursor(db.pymysql.cursors.Cursor) as cursor:
             # Load students
             cursor.execute("SELECT reg_no, face_encoding FROM students")
-            students = cursor.fetchall()
-            known_face_encodings_students = [
-                np.array(json.loads(s['face_encoding'])) for s in students
-            ]
-            known_face_ids_students = [s['reg_no'] for s in students]
+            rows = cursor.fetchall()
+            known_face_encodings_students = _encoding_matrix([row[1] for row in rows])
+            known_face_sq_students = _squared_norms(known_face_encodings_students)
+            known_face_ids_students = [row[0] for row in rows]
             print("Loaded", len(known_face_ids_students), "student faces.")
             
             # Load staff
             cursor.execute("SELECT staff_id, face_encoding FROM staff")
-            staff = cursor.fetchall()
-            known_face_encodings_staff = [
-                np.array(json.loads(s['face_encoding'])) for s in staff
-            ]
-            known_face_ids_staff = [s['staff_id'] for s in staff]
+            rows = cursor.fetchall()
+            known_face_encodings_staff = _encoding_matrix([row[1] for row in rows])
+            known_face_sq_staff = _squared_norms(known_face_encodings_staff)
+            known_face_ids_staff = [row[0] for row in rows]
             print("Loaded", len(known_face_ids_staff), "staff faces.")
+        # Point recognize() at the freshly loaded arrays
+        set_active_user_type(_active_user_type)
     except Exception as e:
         print(f"Error loading faces: {e}")
     finally:
         if conn:
             conn.close()
 
-def recognize(frame, user_type):
-    """Recognizes a face in the frame and returns the corresponding ID."""
-    face_locations = face_recognition.face_locations(frame)
+def encode_face(frame):
+    """
+    Returns the encoding of the first face in the (BGR camera) frame, or None.
+    Faces are located on a downscaled copy; the encoding uses the full frame,
+    converted to the RGB order face_recognition expects. Faces registered
+    before the switch to RGB were encoded from BGR and match less reliably
+    until they are re-enrolled (see update_student_face / update_staff_face).
+    """
+    face_locations = detect_faces(frame)
     if not face_locations:
-        return 'no_persons_found'
-    
-    face_encodings = face_recognition.face_encodings(frame, face_locations)
-    
+        return None
+    rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    return face_recognition.face_encodings(rgb, face_locations[:1])[0]
+
+def set_active_user_type(user_type):
+    """
+    Selects the faces recognize() matches against: 'student', or staff for
+    anything else. Call it when the user switches portals; load_known_faces
+    re-applies it after every reload.
+    """
+    global _active_user_type, _active_faces
+    _active_user_type = user_type
     if user_type == 'student':
-        encodings_to_check, ids_to_check = (
-            known_face_encodings_students,
-            known_face_ids_students
-        )
+        _active_faces = (known_face_encodings_students, known_face_sq_students, known_face_ids_students)
     else:
-        encodings_to_check, ids_to_check = (
-            known_face_encodings_staff,
-            known_face_ids_staff
-        )
+        _active_faces = (known_face_encodings_staff, known_face_sq_staff, known_face_ids_staff)
 
-    if not encodings_to_check:
-        return 'unknown_person'
+def recognize(frame):
+    """
+    Recognizes a face in the (BGR camera) frame, matching against the faces
+    picked by set_active_user_type. Returns (ID, encoding); the encoding can be
+    handed to verify_face/verify_staff_face so they don't detect the face again.
+    """
+    probe = encode_face(frame)
+    if probe is None:
+        return 'no_persons_found', None
+    
+    encodings_to_check, sq_norms, ids_to_check = _active_faces
+
+    if len(encodings_to_check) == 0:
+        return 'unknown_person', probe
         
-    matches = face_recognition.compare_faces(encodings_to_check, face_encodings[0])
+    # Squared distance to every known face as |k|^2 + |q|^2 - 2 k.q: one
+    # matrix-vector product, no (M, 128) temporary. The closest face wins if
+    # it is within tolerance
+    probe = probe.astype(np.float32)
+    sq_distances = sq_norms + float(probe @ probe) - 2.0 * (encodings_to_check @ probe)
+    best_match_index = int(sq_distances.argmin())
     
-    if True in matches:
-        first_match_index = matches.index(True)
-        return ids_to_check[first_match_index]
+    if sq_distances[best_match_index] <= MATCH_TOLERANCE ** 2:
+        return ids_to_check[best_match_index], probe
     else:
-        return 'unknown_person'
+        return 'unknown_person', probe
 
-def verify_face(frame, reg_no):
-    """Verifies if the face in the frame matches the registered face for the given reg_no."""
+def _verify(frame, user_id, ids, encodings, id_label, precomputed_encoding=None):
+    """Checks the face in the frame (or its precomputed encoding) against one registered user."""
     try:
-        target_index = known_face_ids_students.index(reg_no)
-        known_encoding = known_face_encodings_students[target_index]
+        target_index = ids.index(user_id)
+        known_encoding = encodings[target_index]
     except ValueError:
-        print(f"Verification Error: Register number '{reg_no}' not found.")
+        print(f"Verification Error: {id_label} '{user_id}' not found.")
         return False
 
-    face_locations = face_recognition.face_locations(frame)
-    if not face_locations:
+    unknown_encoding = precomputed_encoding
+    if unknown_encoding is None:
+        unknown_encoding = encode_face(frame)
+    if unknown_encoding is None:
         print("Verification Error: No face detected in the frame to verify.")
         return False
 
-    unknown_encoding = face_recognition.face_encodings(frame, face_locations)[0]
-    matches = face_recognition.compare_faces([known_encoding], unknown_encoding, tolerance=0.5)
-    
-    return matches[0]
+    distance = np.linalg.norm(known_encoding - unknown_encoding.astype(np.float32))
+    return bool(distance <= VERIFY_TOLERANCE)
+
+def verify_face(frame, reg_no, precomputed_encoding=None):
+    """Verifies if the face in the frame matches the registered face for the given reg_no."""
+    return _verify(frame, reg_no, known_face_ids_students, known_face_encodings_students,
+                   "Register number", precomputed_encoding)
 #endregion
 
+def _now():
+    """
+    Today's date and the current time (whole seconds) from one clock reading,
+    as native values for the attendance queries; PyMySQL formats them itself.
+    """
+    now = datetime.now()
+    return now.date(), now.time().replace(microsecond=0)
+
 #region Student Functions
 def add_student(name, reg_no, department, encoding):
     conn = db.create_connection()
@@ -119,9 +232,9 @@ def add_student(name, reg_no, department, encoding):
                 INSERT INTO students (name, reg_no, department, face_encoding)
                 VALUES (%s, %s, %s, %s)
             """
-            cursor.execute(sql, (name, reg_no, department, json.dumps(encoding.tolist())))
+            cursor.execute(sql, (name, reg_no, department, _encoding_to_db(encoding)))
         conn.commit()
-        load_known_faces()
+        _remember_face('student', reg_no, encoding)
         return True
     except db.pymysql.err.IntegrityError:
         return False
@@ -129,6 +242,22 @@ def add_student(name, reg_no, department, encoding):
         if conn:
             conn.close()
 
+def update_student_face(reg_no, encoding):
+    """Replaces the stored face of an already registered student (re-enrollment)."""
+    conn = db.create_connection()
+    if not conn:
+        return False
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("UPDATE students SET face_encoding = %s WHERE reg_no = %s",
+                           (_encoding_to_db(encoding), reg_no))
+        conn.commit()
+        _remember_face('student', reg_no, encoding)
+        return True
+    finally:
+        if conn:
+            conn.close()
+
 def get_student_by_reg_no(reg_no):
     conn = db.create_connection()
     if not conn:
@@ -178,30 +307,25 @@ def mark_student_entry(reg_no):
         return False, "DB Error"
     try:
         with conn.cursor() as cursor:
-            today = date.today().strftime('%Y-%m-%d')
+            today, now_time = _now()
 
-            # 1. Check if there is already an OPEN session for today
-            cursor.execute("""
-                SELECT id
-                FROM attendance_students
-                WHERE reg_no = %s AND date = %s AND time_out IS NULL
-                ORDER BY time_in DESC
-                LIMIT 1
-            """, (reg_no, today))
-            open_session = cursor.fetchone()
-
-            if open_session:
+            # Insert a new session only if there is no OPEN one for today:
+            # check and insert in a single statement
+            rows_affected = cursor.execute("""
+                INSERT INTO attendance_students (reg_no, date, time_in, time_out)
+                SELECT %s, %s, %s, NULL
+                FROM DUAL
+                WHERE NOT EXISTS (
+                    SELECT 1
+                    FROM attendance_students
+                    WHERE reg_no = %s AND date = %s AND time_out IS NULL
+                )
+            """, (reg_no, today, now_time, reg_no, today))
+
+            if rows_affected == 0:
                 # Student already has an active entry without exit
                 return False, "You have already marked ENTRY and haven't EXITED yet for today."
 
-            # 2. Insert a new session for today
-            now_time = datetime.now().strftime('%H:%M:%S')
-            sql = """
-                INSERT INTO attendance_students (reg_no, date, time_in, time_out)
-                VALUES (%s, %s, %s, NULL)
-            """
-            cursor.execute(sql, (reg_no, today, now_time))
-
         conn.commit()
         return True, f"Entry marked at {now_time}."
     except Exception as e:
@@ -228,33 +352,21 @@ def mark_student_exit(reg_no):
         return False, "DB Error"
     try:
         with conn.cursor() as cursor:
-            today = date.today().strftime('%Y-%m-%d')
+            today, now_time = _now()
 
-            # 1. Find latest OPEN session for today
-            cursor.execute("""
-                SELECT id, time_in
-                FROM attendance_students
+            # Close the latest OPEN session for today, if any, in one statement
+            rows_affected = cursor.execute("""
+                UPDATE attendance_students
+                SET time_out = %s
                 WHERE reg_no = %s AND date = %s AND time_out IS NULL
                 ORDER BY time_in DESC
                 LIMIT 1
-            """, (reg_no, today))
-            open_session = cursor.fetchone()
+            """, (now_time, reg_no, today))
 
-            if not open_session:
+            if rows_affected == 0:
                 # No active session to close
                 return False, "No open entry found for today. You haven't entered (or already exited)."
 
-            session_id = open_session['id']
-            now_time = datetime.now().strftime('%H:%M:%S')
-
-            # 2. Close this session by setting time_out
-            sql = """
-                UPDATE attendance_students
-                SET time_out = %s
-                WHERE id = %s
-            """
-            cursor.execute(sql, (now_time, session_id))
-
         conn.commit()
         return True, f"Exit marked at {now_time}."
     except Exception as e:
@@ -268,6 +380,20 @@ def mark_student_exit(reg_no):
 
 #region Staff Functions
 def get_class_schedule():
+    """
+    Returns the class schedule, re-reading it from the database at most once
+    every SCHEDULE_CACHE_SECONDS. Failed or empty loads are not cached.
+    """
+    global _schedule_cache
+    now = time.monotonic()
+    if _schedule_cache is not None and now < _schedule_cache[0]:
+        return _schedule_cache[1]
+    schedule = _fetch_class_schedule()
+    if schedule:
+        _schedule_cache = (now + SCHEDULE_CACHE_SECONDS, schedule)
+    return schedule
+
+def _fetch_class_schedule():
     """
     Fetches the entire class schedule from the database, including the early
     entry grace period, and converts timedelta objects to time objects.
@@ -291,10 +417,7 @@ def get_class_schedule():
                         total_seconds = int(value.total_seconds())
                         hours, remainder = divmod(total_seconds, 3600)
                         minutes, seconds = divmod(remainder, 60)
-                        row[key] = datetime.strptime(
-                            f"{hours:02}:{minutes:02}:{seconds:02}",
-                            '%H:%M:%S'
-                        ).time()
+                        row[key] = dt_time(hours, minutes, seconds)
                 corrected_schedule.append(row)
             
             return corrected_schedule
@@ -316,9 +439,9 @@ def add_staff(name, staff_id, course_id, subject, encoding):
                 INSERT INTO staff (name, staff_id, course_id, subject, face_encoding)
                 VALUES (%s, %s, %s, %s, %s)
             """
-            cursor.execute(sql, (name, staff_id, course_id, subject, json.dumps(encoding.tolist())))
+            cursor.execute(sql, (name, staff_id, course_id, subject, _encoding_to_db(encoding)))
         conn.commit()
-        load_known_faces()
+        _remember_face('staff', staff_id, encoding)
         return True
     except db.pymysql.err.IntegrityError:
         return False
@@ -326,6 +449,22 @@ def add_staff(name, staff_id, course_id, subject, encoding):
         if conn:
             conn.close()
 
+def update_staff_face(staff_id, encoding):
+    """Replaces the stored face of an already registered staff member (re-enrollment)."""
+    conn = db.create_connection()
+    if not conn:
+        return False
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("UPDATE staff SET face_encoding = %s WHERE staff_id = %s",
+                           (_encoding_to_db(encoding), staff_id))
+        conn.commit()
+        _remember_face('staff', staff_id, encoding)
+        return True
+    finally:
+        if conn:
+            conn.close()
+
 def get_staff_by_id(staff_id):
     conn = db.create_connection()
     if not conn:
@@ -345,8 +484,7 @@ def mark_staff_entry(staff_id, hour):
         return False, "DB Error"
     try:
         with conn.cursor() as cursor:
-            today = date.today().strftime('%Y-%m-%d')
-            now_time = datetime.now().strftime('%H:%M:%S')
+            today, now_time = _now()
             sql = """
                 INSERT INTO attendance_staff (staff_id, date, hour, time_in, status)
                 VALUES (%s, %s, %s, %s, 'Present')
@@ -366,8 +504,7 @@ def mark_staff_exit(staff_id):
         return False, "DB Error"
     try:
         with conn.cursor() as cursor:
-            today = date.today().strftime('%Y-%m-%d')
-            now_time = datetime.now().strftime('%H:%M:%S')
+            today, now_time = _now()
             sql = """
                 UPDATE attendance_staff
                 SET time_out = %s 
@@ -387,25 +524,7 @@ def mark_staff_exit(staff_id):
             conn.close()
 #endregion
 
-# In util.py, add this new function
-def verify_staff_face(frame, staff_id):
+def verify_staff_face(frame, staff_id, precomputed_encoding=None):
     """Verifies if the face in the frame matches the registered face for the given staff_id."""
-    try:
-        # Search in the global list of known staff faces
-        target_index = known_face_ids_staff.index(staff_id)
-        known_encoding = known_face_encodings_staff[target_index]
-    except ValueError:
-        # This happens if the manually entered staff_id doesn't exist
-        print(f"Verification Error: Staff ID '{staff_id}' not found.")
-        return False
-
-    face_locations = face_recognition.face_locations(frame)
-    if not face_locations:
-        print("Verification Error: No face detected in the frame to verify.")
-        return False
-
-    # Compare the face in the camera with the known face for that staff ID
-    unknown_encoding = face_recognition.face_encodings(frame, face_locations)[0]
-    matches = face_recognition.compare_faces([known_encoding], unknown_encoding, tolerance=0.5)
-    
-    return matches[0]
+    return _verify(frame, staff_id, known_face_ids_staff, known_face_encodings_staff,
+                   "Staff ID", precomputed_encoding)